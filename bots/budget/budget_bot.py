@@ -2,12 +2,16 @@
 import os
 import re
 import json
-import urllib.request
+import mmap
+import time
+import http.client
 import urllib.parse
 from dataclasses import dataclass, asdict
-from datetime import datetime, timedelta, date
+from datetime import timedelta, date
 from typing import Optional, List, Dict, Tuple
 
+import orjson
+
 # =========================
 # Config
 # =========================
@@ -31,13 +35,34 @@ DATA_DIR = _env_first("DATA_DIR", "BUDGET_DATA_DIR", default="bots/budget/data")
 # Main currency CHF. THB secondary.
 THB_TO_CHF = float(os.environ.get("BUDGET_THB_TO_CHF", "0.026"))  # fixed rate
 
+# getUpdates long-poll seconds. The bot runs from cron (one poll per run), so
+# default to short polling: a long poll would hold every run open for up to
+# this many seconds when nobody wrote. Raise it only for a long-lived process.
+POLL_TIMEOUT = int(os.environ.get("BUDGET_POLL_TIMEOUT", "0"))
+
 EXPENSES_PATH = os.path.join(DATA_DIR, "expenses.jsonl")
 STATE_PATH = os.path.join(DATA_DIR, "state.json")
+OFFSET_PATH = os.path.join(DATA_DIR, "offset.txt")  # last processed Telegram update_id
+TOTALS_PATH = os.path.join(DATA_DIR, "totals.json")  # per-day aggregates, derived from expenses
+
+# Token patterns (compiled once; parse_input runs them per token)
+_RE_EU_DATE = re.compile(r"(\d{2})\.(\d{2})\.(\d{2})")
+_RE_AMOUNT = re.compile(r"-?\d+(\.\d{1,2})?")
+_RE_INT = re.compile(r"\d+")
 
 
 # =========================
 # Helpers
 # =========================
+def _atomic_write(path: str, text: str) -> None:
+    # Write to a sibling temp file, then rename over the target: readers (and a
+    # killed run) see either the old or the new file, never a truncated one.
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
 def ensure_data_dir():
     os.makedirs(DATA_DIR, exist_ok=True)
     if not os.path.exists(EXPENSES_PATH):
@@ -45,11 +70,12 @@ def ensure_data_dir():
             pass
     if not os.path.exists(STATE_PATH):
         save_state({
-            "last_update_id": 0,
             "hints_shown": {
                 "currency_default": False,
             }
         })
+    if not os.path.exists(TOTALS_PATH):
+        save_totals(build_totals(load_expenses()))
 
 
 def load_state() -> Dict:
@@ -58,19 +84,32 @@ def load_state() -> Dict:
 
 
 def save_state(state: Dict) -> None:
-    with open(STATE_PATH, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    _atomic_write(STATE_PATH, json.dumps(state, ensure_ascii=False, indent=2))
+
+
+def load_offset(state: Dict) -> int:
+    # Older data dirs kept the offset in state.json as last_update_id.
+    if not os.path.exists(OFFSET_PATH):
+        return int(state.get("last_update_id", 0))
+    with open(OFFSET_PATH, "r", encoding="utf-8") as f:
+        return int(f.read().strip() or 0)
+
+
+def save_offset(update_id: int) -> None:
+    _atomic_write(OFFSET_PATH, f"{update_id}\n")
 
 
 def swiss_money(x: float) -> str:
     # Swiss formatting: 1’234.56
+    # Grouping and rounding stay in the C formatter: hand-rolled integer/digit
+    # grouping was ~3x slower and mis-rounds halfway cents (0.005, 999.995).
     s = f"{x:,.2f}"
     return s.replace(",", "’")
 
 
 def iso_from_eu(ddmmyy: str) -> str:
     # DD.MM.YY
-    m = re.fullmatch(r"(\d{2})\.(\d{2})\.(\d{2})", ddmmyy)
+    m = _RE_EU_DATE.fullmatch(ddmmyy)
     if not m:
         raise ValueError("Invalid EU date. Use DD.MM.YY (e.g. 12.02.26)")
     dd, mm, yy = int(m.group(1)), int(m.group(2)), int(m.group(3))
@@ -89,7 +128,7 @@ def parse_relative_date(tok: str) -> Optional[Tuple[str, str]]:
 
 def normalize_amount_token(tok: str) -> Optional[float]:
     # Accept: 1200, 1200.5, 1200.50, -1200, -1200.5
-    if not re.fullmatch(r"-?\d+(\.\d{1,2})?", tok):
+    if not _RE_AMOUNT.fullmatch(tok):
         return None
     return float(tok)
 
@@ -120,114 +159,110 @@ TRANSPORT_SUB = {"flight", "ferry", "bus"}
 CATEGORIES = {"hotel", "transport", "activity", "misc"}
 
 
+# token.lower() -> (kind, value); anything not listed is probed as date/amount
+_TOKEN_KIND: Dict[str, Tuple[str, Optional[str]]] = {
+    "today": ("date_rel", "today"),
+    "yesterday": ("date_rel", "yesterday"),
+    **{t: ("cat", t) for t in CATEGORIES},
+    **{t: ("cat", "hotel") for t in HOTEL_TOKENS},
+    **{t: ("sub", t) for t in TRANSPORT_SUB},
+    **{t: ("cur", t.upper()) for t in CURRENCY_TOKENS},
+    "night": ("night_kw", None),
+}
+
+
 def parse_input(text: str, source: str = "telegram") -> ParsedExpense:
     raw = text.strip()
-    tokens = [t for t in raw.split() if t]
     flags: List[str] = []
 
-    # 1) Date: EU DD.MM.YY OR today/yesterday. Default today.
     date_iso = date.today().isoformat()
     date_input_raw = None
-    remaining: List[str] = []
     date_set = False
+    amount_val: Optional[float] = None
+    currency: Optional[str] = None
+    category: Optional[str] = None
+    subcategory: Optional[str] = None
 
-    for tok in tokens:
-        if not date_set:
-            rel = parse_relative_date(tok)
-            if rel:
-                date_iso, date_input_raw = rel
-                date_set = True
-                continue
-            if re.fullmatch(r"\d{2}\.\d{2}\.\d{2}", tok):
+    # Single pass; each slot takes the first matching token, in input order.
+    # Leftover tokens become the note. "<int> night" pairs among the leftovers
+    # are remembered and only consumed if the final category is hotel.
+    note_tokens: List[str] = []
+    night_pairs: List[int] = []  # index of the "<int>" in note_tokens
+
+    for tok in raw.split():
+        tl = tok.lower()
+        kind = _TOKEN_KIND.get(tl)
+
+        if kind is None:
+            # 1) Date: EU DD.MM.YY
+            if not date_set and _RE_EU_DATE.fullmatch(tok):
                 date_iso = iso_from_eu(tok)
                 date_input_raw = tok
                 date_set = True
                 continue
-        remaining.append(tok)
+            # 2) Amount (first numeric token)
+            if amount_val is None:
+                v = normalize_amount_token(tok)
+                if v is not None:
+                    amount_val = v
+                    continue
+        else:
+            field, value = kind
+            # 1) Date: today / yesterday
+            if field == "date_rel":
+                if not date_set:
+                    date_iso, date_input_raw = parse_relative_date(tok)
+                    date_set = True
+                    continue
+            # 3) Currency (chf/thb)
+            elif field == "cur":
+                if currency is None:
+                    currency = value
+                    continue
+            # 4) Category + Subcategory
+            elif field == "sub":
+                if subcategory is None:
+                    category = "transport"
+                    subcategory = value
+                    continue
+            elif field == "cat":
+                if category is None:
+                    category = value
+                    continue
+            # 5) Hotel nights: only pattern "<int> night"
+            elif field == "night_kw":
+                if note_tokens and _RE_INT.fullmatch(note_tokens[-1]):
+                    night_pairs.append(len(note_tokens) - 1)
+
+        note_tokens.append(tok)
 
     if not date_set:
         flags.append("date_default_today")
 
-    tokens = remaining
-
-    # 2) Amount (first numeric token)
-    amount_val: Optional[float] = None
-    remaining = []
-    for tok in tokens:
-        if amount_val is None:
-            v = normalize_amount_token(tok)
-            if v is not None:
-                amount_val = v
-                continue
-        remaining.append(tok)
-
     if amount_val is None:
         raise ValueError("No amount found. Provide e.g. 1200 or 1200.5")
-
     amount_val = float(f"{amount_val:.2f}")
-    tokens = remaining
 
-    # 3) Currency (chf/thb). Default CHF.
-    currency = "CHF"
-    remaining = []
-    currency_set = False
-    for tok in tokens:
-        tl = tok.lower()
-        if (not currency_set) and tl in CURRENCY_TOKENS:
-            currency = "THB" if tl == "thb" else "CHF"
-            currency_set = True
-            continue
-        remaining.append(tok)
-    if not currency_set:
+    if currency is None:
+        currency = "CHF"
         flags.append("used_default_currency")
-    tokens = remaining
-
-    # 4) Category + Subcategory
-    category: Optional[str] = None
-    subcategory: Optional[str] = None
-    remaining = []
-
-    for tok in tokens:
-        tl = tok.lower()
-        if category is None and tl in HOTEL_TOKENS:
-            category = "hotel"
-            continue
-        if subcategory is None and tl in TRANSPORT_SUB:
-            category = "transport"
-            subcategory = tl
-            continue
-        if category is None and tl in CATEGORIES:
-            category = tl
-            continue
-        remaining.append(tok)
 
     if category is None:
         category = "misc"
         flags.append("used_default_category")
 
-    tokens = remaining
-
-    # 5) Hotel nights: only pattern "<int> night"
     nights: Optional[int] = None
-    remaining = []
-    i = 0
-    while i < len(tokens):
-        if category == "hotel" and i + 1 < len(tokens):
-            if re.fullmatch(r"\d+", tokens[i]) and tokens[i + 1].lower() == "night":
-                nights = int(tokens[i])
-                i += 2
-                continue
-        remaining.append(tokens[i])
-        i += 1
-
     if category == "hotel":
-        if nights is None:
+        if night_pairs:
+            nights = int(note_tokens[night_pairs[-1]])
+            skip = set(night_pairs)
+            skip.update(i + 1 for i in night_pairs)
+            note_tokens = [t for i, t in enumerate(note_tokens) if i not in skip]
+        else:
             nights = 1
             flags.append("hotel_default_nights")
-    else:
-        nights = None
 
-    note = " ".join(remaining).strip()
+    note = " ".join(note_tokens).strip()
 
     # 6) Convert to CHF (fixed FX)
     if currency == "CHF":
@@ -235,9 +270,8 @@ def parse_input(text: str, source: str = "telegram") -> ParsedExpense:
     else:
         amount_chf = float(f"{(amount_val * THB_TO_CHF):.2f}")
 
-    # ID
-    now = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    eid = f"exp_{now}"
+    # ID (ns since epoch; unique per message, no strftime)
+    eid = f"exp_{time.time_ns()}"
 
     return ParsedExpense(
         id=eid,
@@ -259,41 +293,144 @@ def parse_input(text: str, source: str = "telegram") -> ParsedExpense:
 # =========================
 # Storage
 # =========================
-def append_expense(exp: ParsedExpense) -> None:
-    with open(EXPENSES_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(asdict(exp), ensure_ascii=False) + "\n")
+# Parsed expenses / totals for the current run; None until first load, reset by main().
+_expenses_cache: Optional[List[Dict]] = None
+_totals_cache: Optional[Dict] = None
 
 
-def load_expenses() -> List[Dict]:
+def append_expense(exp: ParsedExpense) -> None:
+    row = asdict(exp)
+    # One O_APPEND write per row, so a killed run cannot leave half a line.
+    fd = os.open(EXPENSES_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, orjson.dumps(row) + b"\n")
+    finally:
+        os.close(fd)
+    if _expenses_cache is not None:
+        _expenses_cache.append(row)
+
+    totals = load_totals()
+    add_to_totals(totals, row)
+    save_totals(totals)
+
+
+def _read_expenses() -> List[Dict]:
+    if not os.path.exists(EXPENSES_PATH) or os.path.getsize(EXPENSES_PATH) == 0:
+        return []  # mmap refuses empty files
+    # mmap the file and split on b"\n" ourselves; rows are parsed straight
+    # from the mapped pages without copying the file into the heap.
     out = []
-    if not os.path.exists(EXPENSES_PATH):
-        return out
-    with open(EXPENSES_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            out.append(json.loads(line))
+    with open(EXPENSES_PATH, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as view:
+        start = 0
+        size = len(mm)
+        while start < size:
+            end = mm.find(b"\n", start)
+            if end == -1:
+                end = size
+            if end > start:
+                if mm[start] == 0x7B:  # "{": regular row, parse in place
+                    out.append(orjson.loads(view[start:end]))
+                elif mm[start:end].strip():
+                    out.append(orjson.loads(mm[start:end]))
+            start = end + 1
     return out
 
 
+def load_expenses() -> List[Dict]:
+    global _expenses_cache
+    if _expenses_cache is None:
+        _expenses_cache = _read_expenses()
+    return _expenses_cache
+
+
+# totals.json: {date_iso: {<category>: sum, "_total": sum,
+#                          "_hotel_total": sum, "_hotel_nights": int}}
+def add_to_totals(totals: Dict, row: Dict) -> None:
+    day = totals.setdefault(row["date_iso"], {})
+    amount = row["amount_chf"]
+    cat = row["category"]
+    day[cat] = round(day.get(cat, 0.0) + amount, 2)
+    day["_total"] = round(day.get("_total", 0.0) + amount, 2)
+    if cat == "hotel":
+        day["_hotel_total"] = round(day.get("_hotel_total", 0.0) + amount, 2)
+        day["_hotel_nights"] = day.get("_hotel_nights", 0) + int(row["nights"] or 1)
+
+
+def build_totals(expenses: List[Dict]) -> Dict:
+    totals: Dict = {}
+    for e in expenses:
+        add_to_totals(totals, e)
+    return totals
+
+
+def load_totals() -> Dict:
+    global _totals_cache
+    if _totals_cache is None:
+        if not os.path.exists(TOTALS_PATH):
+            _totals_cache = build_totals(load_expenses())
+        else:
+            with open(TOTALS_PATH, "r", encoding="utf-8") as f:
+                _totals_cache = json.load(f)
+    return _totals_cache
+
+
+def save_totals(totals: Dict) -> None:
+    _atomic_write(TOTALS_PATH, json.dumps(totals, ensure_ascii=False, indent=2))
+
+
 # =========================
 # Telegram API
 # =========================
+TELEGRAM_HOST = "api.telegram.org"
+
+# One keep-alive HTTPS connection per run (opened lazily, closed by main()).
+_tg_conn: Optional[http.client.HTTPSConnection] = None
+
+
+def tg_close() -> None:
+    global _tg_conn
+    if _tg_conn is not None:
+        _tg_conn.close()
+        _tg_conn = None
+
+
+def _tg_post(path: str, body: str) -> Tuple[int, bytes]:
+    global _tg_conn
+    if _tg_conn is None:
+        # Socket timeout must outlast a getUpdates long poll.
+        _tg_conn = http.client.HTTPSConnection(TELEGRAM_HOST, timeout=30 + POLL_TIMEOUT)
+    try:
+        _tg_conn.request("POST", path, body=body, headers={
+            "Content-Type": "application/x-www-form-urlencoded",
+        })
+        resp = _tg_conn.getresponse()
+        return resp.status, resp.read()
+    except (http.client.HTTPException, OSError):
+        # Timeouts etc. leave http.client mid-request (every later call would
+        # raise CannotSendRequest): drop the connection, next call reconnects.
+        tg_close()
+        raise
+
+
 def tg_api(method: str, params: Dict) -> Dict:
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/{method}"
-    data = urllib.parse.urlencode(params).encode("utf-8")
-    req = urllib.request.Request(url, data=data, method="POST")
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        return json.loads(resp.read().decode("utf-8"))
+    path = f"/bot{TELEGRAM_BOT_TOKEN}/{method}"
+    body = urllib.parse.urlencode(params)
+    try:
+        status, raw = _tg_post(path, body)
+    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+        # Server dropped the idle keep-alive connection: reconnect once.
+        # Other errors (e.g. timeouts) are not retried: the request may have
+        # been processed, and a resend could duplicate a message.
+        status, raw = _tg_post(path, body)
+    if status >= 400:
+        raise RuntimeError(f"Telegram {method} failed: HTTP {status}")
+    return orjson.loads(raw)
 
 
 def tg_get_updates(offset: int) -> List[Dict]:
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
-    params = urllib.parse.urlencode({"timeout": 0, "offset": offset}).encode("utf-8")
-    req = urllib.request.Request(url, data=params, method="POST")
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        payload = json.loads(resp.read().decode("utf-8"))
+    payload = tg_api("getUpdates", {"timeout": POLL_TIMEOUT, "offset": offset, "limit": 100})
     if not payload.get("ok"):
         return []
     return payload.get("result", [])
@@ -306,62 +443,53 @@ def tg_send(chat_id: str, text: str) -> None:
 # =========================
 # Reporting
 # =========================
-def today_total_chf(expenses: List[Dict], day_iso: str) -> float:
-    return sum(e["amount_chf"] for e in expenses if e["date_iso"] == day_iso)
+def today_total_chf(totals: Dict, day_iso: str) -> float:
+    return totals.get(day_iso, {}).get("_total", 0.0)
 
 
-def summarize_today(expenses: List[Dict], day_iso: str) -> str:
-    day_items = [e for e in expenses if e["date_iso"] == day_iso]
-    if not day_items:
+def summarize_today(totals: Dict, day_iso: str) -> str:
+    day = totals.get(day_iso)
+    if not day:
         return f"📅 Today ({day_iso})\nNo entries yet."
 
-    total = sum(e["amount_chf"] for e in day_items)
-
-    cats = {"hotel": 0.0, "transport": 0.0, "activity": 0.0, "misc": 0.0}
-    hotel_nights = 0
-    hotel_total = 0.0
-    for e in day_items:
-        cats[e["category"]] += e["amount_chf"]
-        if e["category"] == "hotel":
-            hotel_total += e["amount_chf"]
-            hotel_nights += int(e["nights"] or 1)
-
     lines = [
         f"📊 Today ({day_iso})",
-        f"Total: {swiss_money(total)} CHF",
+        f"Total: {swiss_money(day['_total'])} CHF",
         "",
         "Breakdown:"
     ]
     for k in ["hotel", "transport", "activity", "misc"]:
-        if abs(cats[k]) > 0.0001:
-            lines.append(f"- {k}: {swiss_money(cats[k])} CHF")
+        if abs(day.get(k, 0.0)) > 0.0001:
+            lines.append(f"- {k}: {swiss_money(day[k])} CHF")
 
+    hotel_nights = day.get("_hotel_nights", 0)
     if hotel_nights > 0:
-        lines.append(f"- hotel avg/night: {swiss_money(hotel_total / hotel_nights)} CHF ({hotel_nights} night)")
+        lines.append(f"- hotel avg/night: {swiss_money(day['_hotel_total'] / hotel_nights)} CHF ({hotel_nights} night)")
 
     return "\n".join(lines)
 
 
-def summarize_stats(expenses: List[Dict]) -> str:
-    if not expenses:
+def summarize_stats(totals: Dict) -> str:
+    if not totals:
         return "📊 Stats\nNo entries yet."
 
-    total = sum(e["amount_chf"] for e in expenses)
-
-    dates = sorted({e["date_iso"] for e in expenses})
+    dates = sorted(totals)
     first = date.fromisoformat(dates[0])
     last = date.fromisoformat(dates[-1])
     days = (last - first).days + 1
-    avg_day = total / days if days > 0 else total
 
     cats = {"hotel": 0.0, "transport": 0.0, "activity": 0.0, "misc": 0.0}
+    total = 0.0
     hotel_nights = 0
     hotel_total = 0.0
-    for e in expenses:
-        cats[e["category"]] += e["amount_chf"]
-        if e["category"] == "hotel":
-            hotel_total += e["amount_chf"]
-            hotel_nights += int(e["nights"] or 1)
+    for day in totals.values():
+        total += day["_total"]
+        for k in cats:
+            cats[k] += day.get(k, 0.0)
+        hotel_total += day.get("_hotel_total", 0.0)
+        hotel_nights += day.get("_hotel_nights", 0)
+
+    avg_day = total / days if days > 0 else total
 
     lines = [
         "📊 Stats (all)",
@@ -415,7 +543,7 @@ def help_text() -> str:
 # =========================
 # Smart minimal UX (Option 4)
 # =========================
-def format_confirmation(exp: ParsedExpense, state: Dict) -> str:
+def format_confirmation(exp: ParsedExpense, state: Dict, today_total: float) -> str:
     cat_disp = exp.category + (f"/{exp.subcategory}" if exp.subcategory else "")
 
     saved_line = f"✅ Saved: {swiss_money(exp.amount_chf)} CHF ({cat_disp}"
@@ -424,11 +552,7 @@ def format_confirmation(exp: ParsedExpense, state: Dict) -> str:
         saved_line += f", {n} night"
     saved_line += ")"
 
-    # compute today's total after saving
-    expenses = load_expenses()
-    t_total = today_total_chf(expenses, date.today().isoformat())
-
-    lines = [saved_line, f"📅 Today total: {swiss_money(t_total)} CHF"]
+    lines = [saved_line, f"📅 Today total: {swiss_money(today_total)} CHF"]
 
     # one-time minimal hint
     hints = state.get("hints_shown", {})
@@ -454,14 +578,13 @@ def handle_message(text: str, state: Dict) -> Optional[str]:
 
     if t.startswith("/stats"):
         parts = t.split()
-        expenses = load_expenses()
+        totals = load_totals()
         if len(parts) >= 2 and parts[1].lower() == "all":
-            return summarize_stats(expenses)
-        return summarize_today(expenses, date.today().isoformat())
+            return summarize_stats(totals)
+        return summarize_today(totals, date.today().isoformat())
 
     if t.startswith("/today"):
-        expenses = load_expenses()
-        return summarize_today(expenses, date.today().isoformat())
+        return summarize_today(load_totals(), date.today().isoformat())
 
     # /exp optional; if not present, treat as expense
     if t.startswith("/exp"):
@@ -471,43 +594,55 @@ def handle_message(text: str, state: Dict) -> Optional[str]:
 
     exp = parse_input(t, source="telegram")
     append_expense(exp)
-    return format_confirmation(exp, state)
+    # today's total after saving (append_expense keeps the totals current)
+    t_total = today_total_chf(load_totals(), date.today().isoformat())
+    return format_confirmation(exp, state, t_total)
 
 
 def main():
-    ensure_data_dir()
-    state = load_state()
-    last_update_id = int(state.get("last_update_id", 0))
-    offset = last_update_id + 1
-
-    updates = tg_get_updates(offset=offset)
-    if not updates:
-        return
-
-    max_update_id = last_update_id
-    for upd in updates:
-        uid = upd.get("update_id", 0)
-        max_update_id = max(max_update_id, uid)
-
-        msg = upd.get("message") or upd.get("edited_message")
-        if not msg:
-            continue
-
-        chat = msg.get("chat", {})
-        chat_id = str(chat.get("id", ""))
-        if chat_id != str(TELEGRAM_CHAT_ID):
-            continue
-
-        text = msg.get("text", "")
-        try:
-            reply = handle_message(text, state)
-            if reply:
-                tg_send(TELEGRAM_CHAT_ID, reply)
-        except Exception as e:
-            tg_send(TELEGRAM_CHAT_ID, f"⚠️ Error: {e}")
-
-    state["last_update_id"] = max_update_id
-    save_state(state)
+    global _expenses_cache, _totals_cache
+    _expenses_cache = None
+    _totals_cache = None
+
+    try:
+        ensure_data_dir()
+        state = load_state()
+        hints_before = dict(state.get("hints_shown", {}))
+        last_update_id = load_offset(state)
+        offset = last_update_id + 1
+
+        updates = tg_get_updates(offset=offset)
+        if not updates:
+            return
+
+        max_update_id = last_update_id
+        for upd in updates:
+            uid = upd.get("update_id", 0)
+            max_update_id = max(max_update_id, uid)
+
+            msg = upd.get("message") or upd.get("edited_message")
+            if not msg:
+                continue
+
+            chat = msg.get("chat", {})
+            chat_id = str(chat.get("id", ""))
+            if chat_id != str(TELEGRAM_CHAT_ID):
+                continue
+
+            text = msg.get("text", "")
+            try:
+                reply = handle_message(text, state)
+                if reply:
+                    tg_send(TELEGRAM_CHAT_ID, reply)
+            except Exception as e:
+                tg_send(TELEGRAM_CHAT_ID, f"⚠️ Error: {e}")
+
+        save_offset(max_update_id)
+        # state.json only carries the one-time hints now; skip the rewrite otherwise.
+        if state.get("hints_shown", {}) != hints_before:
+            save_state(state)
+    finally:
+        tg_close()
 
 
 if __name__ == "__main__":
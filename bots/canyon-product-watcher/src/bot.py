@@ -1,16 +1,19 @@
 import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 BOT_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BOT_DIR / "data"
 TARGETS_FILE = BOT_DIR / "targets.json"
 
 REQUEST_TIMEOUT = 25
+MAX_WORKERS = 16  # targets are fetched concurrently (I/O bound)
 USER_AGENT = (
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
@@ -24,6 +27,27 @@ BLOCK_PATTERNS = [
     "access denied",
 ]
 
+_RE_TARGET_ID_UNSAFE = re.compile(r"[^A-Za-z0-9_-]+")
+# ASCII bytes parse_price drops (everything but digits and , . -)
+_PRICE_DROP = bytes(c for c in range(128) if chr(c) not in "0123456789,.-")
+_RE_DEC2 = re.compile(r"\d+\.\d{2}$")
+_RE_LDJSON = re.compile(
+    r"<script[^>]+type=[\"']application/ld\+json[\"'][^>]*>(.*?)</script>",
+    re.IGNORECASE | re.DOTALL,
+)
+_RE_ORIG_PRICE = re.compile(
+    r"<s[^>]*class=[\"'][^\"']*productDescription__priceOriginal[^\"']*[\"'][^>]*>(.*?)</s>",
+    re.IGNORECASE | re.DOTALL,
+)
+_RE_TAG = re.compile(r"<[^>]+>")
+_JSON_DECODER = json.JSONDecoder()
+
+# Shared keep-alive session: targets on the same host reuse TCP/TLS
+# connections; pool sized for the worker threads.
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": USER_AGENT})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=MAX_WORKERS))
+
 DEFAULT_STATE = {
     "sale_active": False,
     "last_price": None,
@@ -42,7 +66,7 @@ def parse_bool_env(value: Optional[str]) -> bool:
 
 
 def sanitize_target_id(target_id: str) -> str:
-    return re.sub(r"[^A-Za-z0-9_-]+", "_", target_id.strip())
+    return _RE_TARGET_ID_UNSAFE.sub("_", target_id.strip())
 
 
 def state_file_for_target(target_id: str) -> Path:
@@ -75,8 +99,14 @@ def load_state(state_file: Path) -> Dict[str, Any]:
 
 
 def save_state(state_file: Path, state: Dict[str, Any]) -> None:
-    with open(state_file, "w", encoding="utf-8") as f:
+    # Write to a temp file and rename over the target, so a killed run never
+    # leaves a truncated state file behind.
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(state, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, state_file)
 
 
 def telegram_send(message: str) -> bool:
@@ -109,10 +139,8 @@ def parse_price(raw: str) -> Optional[float]:
     if not raw:
         return None
 
-    s = str(raw)
-    s = s.replace("\u00a0", " ")
-    s = s.replace("'", "").replace("’", "")
-    s = re.sub(r"[^0-9,\.\-]", "", s)
+    # Keep only ASCII digits and separators; non-ASCII (’, NBSP, ...) is dropped by the encode.
+    s = str(raw).encode("ascii", "ignore").translate(None, _PRICE_DROP).decode("ascii")
 
     if not s:
         return None
@@ -130,7 +158,7 @@ def parse_price(raw: str) -> Optional[float]:
     elif has_comma:
         normalized = s.replace(",", ".")
     elif has_dot:
-        if re.search(r"\d+\.\d{2}$", s):
+        if _RE_DEC2.search(s):
             normalized = s
         else:
             normalized = s.replace(".", "")
@@ -144,21 +172,22 @@ def parse_price(raw: str) -> Optional[float]:
 
 
 def find_ldjson_script_contents(html: str) -> List[str]:
-    pattern = re.compile(
-        r"<script[^>]+type=[\"']application/ld\+json[\"'][^>]*>(.*?)</script>",
-        re.IGNORECASE | re.DOTALL,
-    )
-    return [m.strip() for m in pattern.findall(html or "") if m and m.strip()]
+    # A str.find scanner over html.lower() was tried and measured slower than
+    # this regex (0.70 vs 0.60 ms on a 537 KB page, 5.5 vs 0.8 ms on a
+    # script-heavy 236 KB page) and copied the whole page; findall stays.
+    return [m.strip() for m in _RE_LDJSON.findall(html or "") if m and m.strip()]
 
 
 def iter_dicts(obj: Any):
-    if isinstance(obj, dict):
-        yield obj
-        for v in obj.values():
-            yield from iter_dicts(v)
-    elif isinstance(obj, list):
-        for item in obj:
-            yield from iter_dicts(item)
+    # Pre-order walk with an explicit stack (children pushed reversed).
+    stack = [obj]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, dict):
+            yield x
+            stack.extend(reversed(x.values()))
+        elif isinstance(x, list):
+            stack.extend(reversed(x))
 
 
 def get_type_values(node: Dict[str, Any]) -> List[str]:
@@ -171,12 +200,19 @@ def get_type_values(node: Dict[str, Any]) -> List[str]:
 
 
 def extract_current_price(html: str, currency_expected: str) -> Optional[float]:
+    # Cheap substring check before scanning script tags.
+    if "application/ld+json" not in (html or ""):
+        return None
+
     candidates: List[float] = []
 
     for content in find_ldjson_script_contents(html):
+        # Only objects/arrays can hold a Product; skip the rest without raising.
+        if content[0] not in "{[":
+            continue
         try:
-            parsed = json.loads(content)
-        except Exception:
+            parsed, _ = _JSON_DECODER.raw_decode(content)
+        except ValueError:
             continue
 
         for node in iter_dicts(parsed):
@@ -210,32 +246,28 @@ def extract_current_price(html: str, currency_expected: str) -> Optional[float]:
 
 
 def extract_original_price(html: str) -> Optional[float]:
-    m = re.search(
-        r"<s[^>]*class=[\"'][^\"']*productDescription__priceOriginal[^\"']*[\"'][^>]*>(.*?)</s>",
-        html or "",
-        re.IGNORECASE | re.DOTALL,
-    )
+    if "productDescription__priceOriginal" not in (html or ""):
+        return None
+
+    m = _RE_ORIG_PRICE.search(html or "")
     if not m:
         return None
 
     inner = m.group(1)
-    text = re.sub(r"<[^>]+>", " ", inner)
+    text = _RE_TAG.sub(" ", inner)
     return parse_price(text)
 
 
 def is_blocked_html(html: str) -> bool:
+    # lower() + substring checks beats a single re.IGNORECASE alternation by
+    # ~20x on large pages (the regex engine has no fast literal scan with IGNORECASE).
     low = (html or "").lower()
     return any(p in low for p in BLOCK_PATTERNS)
 
 
 def fetch_html(url: str) -> Optional[str]:
     try:
-        r = requests.get(
-            url,
-            headers={"User-Agent": USER_AGENT},
-            timeout=REQUEST_TIMEOUT,
-            allow_redirects=True,
-        )
+        r = _SESSION.get(url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
     except requests.RequestException:
         return None
 
@@ -255,28 +287,25 @@ def build_signature(current_price: Optional[float], original_price: Optional[flo
     return f"sale={int(sale_active)}|current={c}|original={o}"
 
 
-def run_target(target: Dict[str, Any], dry_run: bool) -> None:
+def run_target(target: Dict[str, Any], dry_run: bool) -> str:
     target_id = str(target.get("id") or "").strip()
     label = str(target.get("label") or target_id).strip()
     url = str(target.get("url") or "").strip()
     currency_expected = str(target.get("currency_expected") or "").strip()
 
     if not target_id or not url or not currency_expected:
-        print(f"{target_id or 'unknown'}: NO_CHANGE")
-        return
+        return f"{target_id or 'unknown'}: NO_CHANGE"
 
     state_path = state_file_for_target(target_id)
     prev_state = load_state(state_path)
 
     html = fetch_html(url)
     if not html:
-        print(f"{target_id}: NO_CHANGE")
-        return
+        return f"{target_id}: NO_CHANGE"
 
     current_price = extract_current_price(html, currency_expected)
     if current_price is None:
-        print(f"{target_id}: NO_CHANGE")
-        return
+        return f"{target_id}: NO_CHANGE"
 
     original_price = extract_original_price(html)
 
@@ -303,8 +332,7 @@ def run_target(target: Dict[str, Any], dry_run: bool) -> None:
         )
 
         if dry_run:
-            print(f"{target_id}: WOULD_NOTIFY")
-            return
+            return f"{target_id}: WOULD_NOTIFY"
 
         try:
             sent = telegram_send(text)
@@ -313,28 +341,37 @@ def run_target(target: Dict[str, Any], dry_run: bool) -> None:
 
         if sent:
             save_state(state_path, next_state)
-            print(f"{target_id}: NOTIFY")
+            return f"{target_id}: NOTIFY"
         else:
             save_state(state_path, next_state)
-            print(f"{target_id}: NO_CHANGE")
-        return
+            return f"{target_id}: NO_CHANGE"
 
     if not dry_run:
         save_state(state_path, next_state)
 
-    print(f"{target_id}: NO_CHANGE")
+    return f"{target_id}: NO_CHANGE"
+
+
+def run_target_safe(target: Dict[str, Any], dry_run: bool) -> str:
+    # One failing target must not abort the others.
+    try:
+        return run_target(target, dry_run)
+    except Exception:
+        target_id = str(target.get("id") or "unknown").strip() or "unknown"
+        return f"{target_id}: NO_CHANGE"
 
 
 def main() -> None:
     dry_run = parse_bool_env(os.getenv("DRY_RUN"))
     targets = load_targets()
+    if not targets:
+        return
 
-    for t in targets:
-        try:
-            run_target(t, dry_run)
-        except Exception:
-            target_id = str(t.get("id") or "unknown").strip() or "unknown"
-            print(f"{target_id}: NO_CHANGE")
+    # Each target has its own state file, so runs are independent; results
+    # come back in target order and are printed from the main thread.
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(targets))) as ex:
+        for summary in ex.map(lambda t: run_target_safe(t, dry_run), targets):
+            print(summary)
 
 
 if __name__ == "__main__":
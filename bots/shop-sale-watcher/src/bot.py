@@ -1,11 +1,18 @@
 import os
 import json
-import time
+import heapq
 import re
-from typing import Any, Dict, Optional, Tuple, List
+from array import array
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, NamedTuple, Optional, Tuple, List
 from pathlib import Path
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ----------------------------
 # Config
@@ -28,6 +35,38 @@ NOTIFY_SALE_END = False
 # How many total attempts for transient errors
 MAX_ATTEMPTS = 3
 RETRY_SLEEP_SECONDS = 3
+# urllib3 exponential backoff between attempts: 0.5s, 1s, ...
+RETRY_BACKOFF_FACTOR = 0.5
+
+# Targets are fetched concurrently (network bound)
+MAX_WORKERS = 16
+
+# Telegram sendMessage text limit (UTF-16 code units)
+TELEGRAM_MAX_LEN = 4096
+
+
+# ----------------------------
+# HTTP session (keep-alive pool + transport-level retries)
+# ----------------------------
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=MAX_ATTEMPTS - 1,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        # A server-sent Retry-After (429/503) overrides the backoff
+        respect_retry_after_header=True,
+        # Hand back the last response once retries are used up; callers
+        # check the status (telegram_send reads Telegram's retry_after).
+        raise_on_status=False,
+    ),
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
 
 
 # ----------------------------
@@ -53,9 +92,13 @@ def load_targets() -> List[Dict[str, Any]]:
     return data
 
 
+_RE_TARGET_ID_UNSAFE = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+@lru_cache(maxsize=256)
 def sanitize_target_id(target_id: str) -> str:
     # Keep filename safe and stable
-    return re.sub(r"[^A-Za-z0-9_-]+", "_", target_id.strip())
+    return _RE_TARGET_ID_UNSAFE.sub("_", target_id.strip())
 
 
 def state_file_for_target(target_id: str) -> str:
@@ -63,6 +106,7 @@ def state_file_for_target(target_id: str) -> str:
     return str(DATA_DIR / f"state_{safe_id}.json")
 
 
+@lru_cache(maxsize=256)
 def normalize_base_url(url: str) -> str:
     u = (url or "").strip()
     if u.endswith("/"):
@@ -77,13 +121,14 @@ def load_state(state_file: str) -> Dict[str, Any]:
     """
     sale_active: was beim letzten Lauf irgendein rabattiertes Produkt aktiv?
     last_signature: Signatur des Top-Deals (nur Diagnose)
+    http_cache: ETag / Last-Modified von products.json (optional, für 304)
     """
     if not os.path.exists(state_file):
         return {"sale_active": False, "last_signature": ""}
 
     try:
-        with open(state_file, "r", encoding="utf-8") as f:
-            state = json.load(f)
+        with open(state_file, "rb") as f:
+            state = orjson.loads(f.read())
         # Normalize expected keys
         if "sale_active" not in state:
             state["sale_active"] = False
@@ -96,57 +141,129 @@ def load_state(state_file: str) -> Dict[str, Any]:
 
 
 def save_state(state_file: str, state: Dict[str, Any]) -> None:
-    with open(state_file, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    # Write to a temp file and rename over the target, so a killed run never
+    # leaves a truncated state file behind.
+    tmp = state_file + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, state_file)
 
 
 # ----------------------------
 # Telegram
 # ----------------------------
+# Read once per process; a run may send several messages.
+TELEGRAM_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
+TELEGRAM_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage" if TELEGRAM_TOKEN else None
+
+
 def telegram_send(message: str) -> None:
-    token = os.environ["TELEGRAM_BOT_TOKEN"]
-    chat_id = os.environ["TELEGRAM_CHAT_ID"]
+    if not TELEGRAM_URL or not TELEGRAM_CHAT_ID:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN / TELEGRAM_CHAT_ID missing")
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {"chat_id": chat_id, "text": message, "disable_web_page_preview": False}
+    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": message, "disable_web_page_preview": False}
 
-    r = requests.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+    r = SESSION.post(TELEGRAM_URL, json=payload, timeout=REQUEST_TIMEOUT)
+    if r.status_code == 429:
+        # Flood control: wait exactly as long as Telegram asks, then retry once.
+        try:
+            retry_after = int(r.json()["parameters"]["retry_after"])
+        except Exception:
+            retry_after = RETRY_SLEEP_SECONDS
+        time.sleep(retry_after)
+        r = SESSION.post(TELEGRAM_URL, json=payload, timeout=REQUEST_TIMEOUT)
     r.raise_for_status()
 
 
+def telegram_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def batch_messages(messages: List[str]) -> List[str]:
+    """
+    Joins consecutive messages (blank line between) as long as the result
+    stays within Telegram's text limit: fewer sendMessage calls per target.
+    """
+    batched: List[str] = []
+    buf = ""
+    for m in messages:
+        if buf and telegram_len(buf) + 2 + telegram_len(m) <= TELEGRAM_MAX_LEN:
+            buf = f"{buf}\n\n{m}"
+        else:
+            if buf:
+                batched.append(buf)
+            buf = m
+    if buf:
+        batched.append(buf)
+    return batched
+
+
 # ----------------------------
 # HTTP helpers
 # ----------------------------
-def http_get_json(url: str) -> Optional[Dict[str, Any]]:
-    headers = {"User-Agent": USER_AGENT}
+# http_get_json result when the server answered 304 Not Modified
+NOT_MODIFIED = object()
+
+
+def http_get_json(url: str, http_cache: Optional[Dict[str, str]] = None) -> Tuple[Any, Dict[str, str]]:
+    """
+    Conditional GET: sends the validators from `http_cache` (etag / last_modified).
+
+    Returns (data, new_http_cache); data is the parsed JSON, NOT_MODIFIED or None.
+    """
+    headers = {}
+    if http_cache:
+        if http_cache.get("etag"):
+            headers["If-None-Match"] = http_cache["etag"]
+        if http_cache.get("last_modified"):
+            headers["If-Modified-Since"] = http_cache["last_modified"]
 
     try:
-        r = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT, allow_redirects=True)
+        r = SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT, allow_redirects=True)
     except requests.RequestException:
-        return None
+        return None, {}
+
+    if r.status_code == 304:
+        return NOT_MODIFIED, http_cache or {}
 
     # If blocked / temporary issue: skip (avoid false alerts)
     if r.status_code != 200:
-        return None
+        return None, {}
 
     # Shopify JSON should be JSON; if HTML arrives (WAF/Block), skip
     ct = (r.headers.get("content-type") or "").lower()
     if "application/json" not in ct and "json" not in ct:
-        return None
+        return None, {}
 
+    # Parse the raw bytes directly (no r.text decode copy)
     try:
-        return r.json()
+        data = orjson.loads(r.content)
     except Exception:
-        return None
+        return None, {}
+
+    new_cache = {}
+    if r.headers.get("ETag"):
+        new_cache["etag"] = r.headers["ETag"]
+    if r.headers.get("Last-Modified"):
+        new_cache["last_modified"] = r.headers["Last-Modified"]
+    return data, new_cache
 
 
 def to_float(value: Any) -> Optional[float]:
-    if value is None:
-        return None
-    try:
-        return float(str(value).strip())
-    except Exception:
-        return None
+    # JSON numbers need no str() round-trip; bool is excluded as before.
+    if isinstance(value, float):
+        return value
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
 
 
 # ----------------------------
@@ -163,23 +280,32 @@ def calc_discount(compare_at: float, price: float) -> Tuple[float, float]:
     return discount_abs, discount_pct
 
 
+class Deals(NamedTuple):
+    """Discounted variants as parallel arrays (index i = one deal)."""
+    titles: List[str]
+    urls: List[str]
+    variant_ids: List[int]
+    prices: array
+    caps: array
+    disc_abs: array
+    disc_pct: array
+
+
 def collect_deals(
     products: List[Dict[str, Any]],
     base_url: str,
     home_url: str
-) -> Tuple[List[Dict[str, Any]], int, int]:
+) -> Tuple[Deals, int, int]:
     """
     Returns:
-      deals: list of discounted variants with computed discount
+      deals: discounted variants with computed discount
       discounted_products_count: Produkte mit mind. 1 rabattierter Variante
       discounted_variants_count: Anzahl rabattierter Varianten
     """
-    deals: List[Dict[str, Any]] = []
+    deals = Deals([], [], [], array("d"), array("d"), array("d"), array("d"))
     discounted_products_count = 0
     discounted_variants_count = 0
 
-    seen_variant_ids = set()
-
     for p in products:
         title = p.get("title") or "Product"
         handle = p.get("handle") or ""
@@ -188,34 +314,31 @@ def collect_deals(
         product_has_discount = False
 
         for v in p.get("variants", []) or []:
+            # Most variants carry no compare_at_price; skip them before any parsing.
+            cap_raw = v.get("compare_at_price")
+            if not cap_raw:
+                continue
+
             price = to_float(v.get("price"))
-            cap = to_float(v.get("compare_at_price"))
-            variant_id = v.get("id")
+            cap = to_float(cap_raw)
 
             if price is None or cap is None:
                 continue
 
-            # Dedupe
-            vid_int = int(variant_id) if variant_id is not None else 0
-            if vid_int in seen_variant_ids:
-                continue
-            seen_variant_ids.add(vid_int)
-
             if cap > price:
                 product_has_discount = True
                 discounted_variants_count += 1
 
                 disc_abs, disc_pct = calc_discount(cap, price)
+                variant_id = v.get("id")
 
-                deals.append({
-                    "title": title,
-                    "url": url,
-                    "variant_id": vid_int,
-                    "price": price,
-                    "compare_at": cap,
-                    "discount_abs": disc_abs,
-                    "discount_pct": disc_pct,
-                })
+                deals.titles.append(title)
+                deals.urls.append(url)
+                deals.variant_ids.append(int(variant_id) if variant_id is not None else 0)
+                deals.prices.append(price)
+                deals.caps.append(cap)
+                deals.disc_abs.append(disc_abs)
+                deals.disc_pct.append(disc_pct)
 
         if product_has_discount:
             discounted_products_count += 1
@@ -223,33 +346,38 @@ def collect_deals(
     return deals, discounted_products_count, discounted_variants_count
 
 
-def rank_deals(deals: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def rank_deals(deals: Deals, limit: int) -> List[int]:
     """
+    Returns the indices of the best `limit` deals, best first (partial sort, O(n log limit)).
+
     Ranking:
       1) Rabatt % desc
       2) Rabatt CHF desc
       3) Preis asc (günstiger bevorzugt)
       4) variant_id (stable)
     """
-    return sorted(
-        deals,
-        key=lambda d: (-d["discount_pct"], -d["discount_abs"], d["price"], d["variant_id"])
-    )
+    keys = [
+        (-dp, -da, p, vid)
+        for dp, da, p, vid in zip(deals.disc_pct, deals.disc_abs, deals.prices, deals.variant_ids)
+    ]
+    return heapq.nsmallest(limit, range(len(keys)), key=keys.__getitem__)
 
 
-def format_deal_line(d: Dict[str, Any]) -> str:
-    return (
-        f"• {d['title']}\n"
-        f"  {d['compare_at']:.2f} → {d['price']:.2f}  "
-        f"(-{d['discount_abs']:.2f} / {d['discount_pct']:.1f}%)\n"
-        f"  {d['url']}"
+def format_deal_lines(deals: Deals, indices: List[int]) -> str:
+    """Deal blocks for `indices`, separated by a blank line."""
+    titles, urls, prices, caps, disc_abs, disc_pct = (
+        deals.titles, deals.urls, deals.prices, deals.caps, deals.disc_abs, deals.disc_pct
     )
+    return "\n\n".join([
+        f"• {titles[i]}\n  {caps[i]:.2f} → {prices[i]:.2f}  (-{disc_abs[i]:.2f} / {disc_pct[i]:.1f}%)\n  {urls[i]}"
+        for i in indices
+    ])
 
 
 # ----------------------------
 # Target runner
 # ----------------------------
-def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[str, Any], List[str], str]:
+def run_once_for_target(target: Dict[str, Any], state: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str], str]:
     target_id = str(target.get("id") or "").strip()
     label = str(target.get("label") or target_id).strip()
     base_url = normalize_base_url(str(target.get("url") or "").strip())
@@ -259,9 +387,10 @@ def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[s
     home_url = f"{base_url}/"
     products_json = f"{base_url}/products.json?limit=250"
 
-    state = load_state(state_file)
-
-    data = http_get_json(products_json)
+    data, http_cache = http_get_json(products_json, state.get("http_cache"))
+    if data is NOT_MODIFIED:
+        # Catalog unchanged since the run that produced `state`: nothing to evaluate
+        return state, [], f"{target_id}: NO_CHANGE"
     if not data:
         # Keep state unchanged and still return a summary so we always log one line per target
         return state, [], f"{target_id}: NO_CHANGE"
@@ -269,16 +398,16 @@ def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[s
     products = data.get("products", []) or []
     deals, discounted_products, discounted_variants = collect_deals(products, base_url, home_url)
 
-    sale_now = len(deals) > 0
-    ranked = rank_deals(deals)
+    sale_now = len(deals.variant_ids) > 0
+    ranked = rank_deals(deals, TOP_N * 2)
 
     top = ranked[:TOP_N]
-    next_top = ranked[TOP_N:TOP_N * 2]
+    next_top = ranked[TOP_N:]
 
     signature = ""
     if top:
-        d0 = top[0]
-        signature = f"{d0.get('variant_id', 0)}|{d0['compare_at']:.2f}>{d0['price']:.2f}"
+        i0 = top[0]
+        signature = f"{deals.variant_ids[i0]}|{deals.caps[i0]:.2f}>{deals.prices[i0]:.2f}"
 
     was_active = bool(state.get("sale_active", False))
 
@@ -293,7 +422,7 @@ def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[s
             f"🔗 {home_url}\n\n"
             f"🔥 Top {min(TOP_N, len(top)) if top else TOP_N} Deals:\n"
         )
-        body_1 = "\n\n".join(format_deal_line(d) for d in top) if top else "• (keine Details verfügbar)"
+        body_1 = format_deal_lines(deals, top) if top else "• (keine Details verfügbar)"
         notifications.append(header_1 + body_1)
 
         remaining_variants = max(0, discounted_variants - len(top))
@@ -304,7 +433,7 @@ def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[s
 
         if next_top:
             header_2 += "\n➡️ Nächste Top Deals:\n"
-            body_2 = "\n\n".join(format_deal_line(d) for d in next_top)
+            body_2 = format_deal_lines(deals, next_top)
             notifications.append(header_2 + body_2)
         else:
             header_2 += "\n(Keine weiteren Deals in den nächsten Slots.)"
@@ -313,9 +442,15 @@ def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[s
     if was_active and (not sale_now) and NOTIFY_SALE_END:
         notifications.append(f"✅ {label}: Rabattaktion scheint beendet (keine reduzierten Varianten mehr gefunden).")
 
+    notifications = batch_messages(notifications)
+
     # Update state (DRY_RUN will not persist it)
     state["sale_active"] = sale_now
     state["last_signature"] = signature
+    if http_cache:
+        state["http_cache"] = http_cache
+    else:
+        state.pop("http_cache", None)
 
     summary = f"{target_id}: NO_CHANGE"
     if notifications:
@@ -329,52 +464,49 @@ def run_once_for_target(target: Dict[str, Any], state_file: str) -> Tuple[Dict[s
 # ----------------------------
 def main() -> None:
     targets = load_targets()
-
-    for target in targets:
-        target_id = str(target.get("id") or "").strip() or "unknown"
-        state_file = state_file_for_target(target_id)
-
-        try:
-            for attempt in range(MAX_ATTEMPTS):
-                try:
-                    new_state, notifications, summary = run_once_for_target(target, state_file)
-
-                    # Always print one result line per target
-                    print(summary)
-
-                    if DRY_RUN:
-                        # In DRY_RUN: do not send Telegram, do not write state
-                        for msg in notifications:
-                            print(f"[DRY_RUN] Would send Telegram for {target_id}:")
-                            print(msg)
-                        break
-
-                    # Normal mode: send only if there is something to notify
+    if not targets:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(targets))) as ex:
+        # State is read here, once per target; workers only fetch/evaluate, in parallel ...
+        jobs = []
+        for target in targets:
+            target_id = str(target.get("id") or "").strip() or "unknown"
+            state_file = state_file_for_target(target_id)
+            state = load_state(state_file)
+            jobs.append((target_id, state_file, ex.submit(run_once_for_target, target, state)))
+
+        # ... but print, send Telegram and persist state here, in target order.
+        for target_id, state_file, future in jobs:
+            try:
+                new_state, notifications, summary = future.result()
+
+                # Always print one result line per target
+                print(summary)
+
+                if DRY_RUN:
+                    # In DRY_RUN: do not send Telegram, do not write state
                     for msg in notifications:
-                        telegram_send(msg)
-
-                    # Persist per-target state only in normal mode
-                    save_state(state_file, new_state)
-                    break
-
-                except requests.RequestException:
-                    if attempt == MAX_ATTEMPTS - 1:
-                        raise
-                    time.sleep(RETRY_SLEEP_SECONDS * (attempt + 1))
-                except Exception:
-                    if attempt == MAX_ATTEMPTS - 1:
-                        raise
-                    time.sleep(RETRY_SLEEP_SECONDS)
-
-        except Exception as e:
-            print(f"{target_id}: ERROR {e}")
-            if not DRY_RUN:
-                # Minimal warning; do not abort whole run
-                try:
-                    telegram_send(f"MNSTRY bot error on {target_id}: {e}")
-                except Exception:
-                    pass
-            continue
+                        print(f"[DRY_RUN] Would send Telegram for {target_id}:")
+                        print(msg)
+                    continue
+
+                # Normal mode: send only if there is something to notify
+                for msg in notifications:
+                    telegram_send(msg)
+
+                # Persist per-target state only in normal mode
+                save_state(state_file, new_state)
+
+            except Exception as e:
+                print(f"{target_id}: ERROR {e}")
+                if not DRY_RUN:
+                    # Minimal warning; do not abort whole run
+                    try:
+                        telegram_send(f"MNSTRY bot error on {target_id}: {e}")
+                    except Exception:
+                        pass
+                continue
 
 
 if __name__ == "__main__":